@@ -1,37 +1,207 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from pydantic import BaseModel
+import asyncio
+import logging
 import tempfile
 import os
-from typing import Optional
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import faiss
+import numpy as np
 
 from src.helper import (
     State, 
     extract_hr_policy_from_pdf, 
     process_invoices, 
-    get_summary
+    delete_policy_cache,
+    get_summary,
+    build_lower_index,
+    shutdown_extraction_pool
+)
+from src.store import (
+    EMBEDDING_DIMENSION,
+    NO_DATA_ANSWER,
+    prepare_employee_index,
+    process_employees_to_pinecone,
+    delete_employee_records,
+    delete_orphaned_employee_records,
+    answer_query_for_employee,
+    stream_query_for_employee,
+    get_query_embedding
 )
-from src.store import process_employees_to_pinecone, answer_query_for_employee
-from src.config import GOOGLE_API_KEY, PINECONE_API_KEY
+from src.config import GOOGLE_API_KEY
 
-app = FastAPI(title="Invoice Reimbursement Analysis API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Set up the Pinecone index before serving, and release the shared PDF
+    extraction workers when the server stops.
+
+    Analyses only live in this process' memory, so at startup every stored
+    namespace is left over from an earlier run and is swept.
+    """
+    await asyncio.to_thread(prepare_employee_index)
+    await asyncio.to_thread(delete_orphaned_employee_records, list(_states))
+    yield
+    shutdown_extraction_pool()
 
-# Global state to store processed data
-global_state = State(
-    md_text="",
-    employee_invoice_data={},
-    extract_invoice_data={}
+app = FastAPI(
+    title="Invoice Reimbursement Analysis API",
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+logger = logging.getLogger(__name__)
+
+# Uploads are copied to disk in 1 MiB chunks instead of being read whole into memory
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Processed data per analysis, keyed by the analysis_id returned from /analyze_invoices
+MAX_STORED_ANALYSES = 32
+_states: "OrderedDict[str, State]" = OrderedDict()
+_states_lock = asyncio.Lock()
+
+# Semantic answer cache: analysis_id -> employee_name -> FAISS index of past queries + answers,
+# keeping the most recent SEMANTIC_CACHE_MAX_ENTRIES answers per employee
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_ENTRIES = 64
+_semantic_caches: Dict[str, Dict[str, dict]] = {}
+
+# Appended to a streamed answer that failed partway, since the 200 status is already sent
+STREAM_ERROR_MARKER = "\n\n[Error: the answer could not be completed. Please try again.]"
+
 class QueryRequest(BaseModel):
+    analysis_id: str
     employee_name: str
     query: str
 
+async def _spool(upload: UploadFile, suffix: str) -> str:
+    """Copy an upload to a temporary file in UPLOAD_CHUNK_SIZE pieces and return its path"""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            temp.write(chunk)
+
+    return temp.name
+
+async def _save_state(analysis_id: str, state: State) -> None:
+    """
+    Store a finished analysis, evicting the oldest ones beyond MAX_STORED_ANALYSES
+    along with their cached answers and Pinecone namespaces.
+    """
+    evicted_namespaces = []
+    async with _states_lock:
+        _states[analysis_id] = state
+        while len(_states) > MAX_STORED_ANALYSES:
+            evicted_id, evicted_state = _states.popitem(last=False)
+            _semantic_caches.pop(evicted_id, None)
+            if evicted_state.get("extract_invoice_data"):
+                evicted_namespaces.append(evicted_id)
+
+    for namespace in evicted_namespaces:
+        await asyncio.to_thread(delete_employee_records, namespace)
+
+async def _semantic_cache_lookup(request: "QueryRequest", employee_name: str) -> tuple:
+    """
+    Embed the query and look it up in employee_name's semantic cache.
+
+    Returns (cache, query vector, cached answer or None); an answer is reused when
+    a past query's embedding has cosine similarity >= SEMANTIC_CACHE_THRESHOLD.
+    Embedding runs in a worker thread; the cache itself is only read and updated
+    on the event loop.
+    """
+    embedding = await asyncio.to_thread(get_query_embedding, request.query)
+    vector = np.asarray([embedding], dtype="float32")
+    faiss.normalize_L2(vector)
+
+    cache = _semantic_caches.setdefault(request.analysis_id, {}).setdefault(
+        employee_name,
+        {"index": faiss.IndexFlatIP(EMBEDDING_DIMENSION), "answers": []}
+    )
+
+    if cache["index"].ntotal:
+        scores, ids = cache["index"].search(vector, 1)
+        if scores[0][0] >= SEMANTIC_CACHE_THRESHOLD:
+            return cache, vector, cache["answers"][ids[0][0]]
+
+    return cache, vector, None
+
+def _remember_answer(cache: dict, vector: np.ndarray, employee_name: str, answer: str) -> None:
+    """
+    Add a freshly generated answer to the semantic cache, dropping the oldest one when full.
+
+    The no-data fallback is not cached: it usually means the record was not yet
+    visible in Pinecone, and later questions should look again.
+    """
+    if answer == NO_DATA_ANSWER.format(employee_name=employee_name):
+        return
+
+    if cache["index"].ntotal >= SEMANTIC_CACHE_MAX_ENTRIES:
+        # IndexFlat renumbers the remaining vectors, keeping them aligned with the list
+        cache["index"].remove_ids(np.array([0], dtype="int64"))
+        cache["answers"].pop(0)
+
+    cache["index"].add(vector)
+    cache["answers"].append(answer)
+
+async def _answer_with_semantic_cache(request: "QueryRequest", employee_name: str) -> str:
+    """Answer a query about employee_name, served from the semantic cache for repeated questions"""
+    cache, vector, answer = await _semantic_cache_lookup(request, employee_name)
+    if answer is not None:
+        return answer
+
+    answer = await asyncio.to_thread(
+        answer_query_for_employee,
+        employee_name=employee_name,
+        query=request.query,
+        namespace=request.analysis_id
+    )
+    _remember_answer(cache, vector, employee_name, answer)
+
+    return answer
+
+async def _resolve_query_employee(request: "QueryRequest") -> str:
+    """Return the stored name of the queried employee, raising 400/404 if it can't be queried"""
+    # Check if data has been processed
+    state = await _get_state(request.analysis_id)
+    if not state.get("extract_invoice_data"):
+        raise HTTPException(
+            status_code=400,
+            detail="No data available. Please analyze invoices first using /analyze_invoices endpoint"
+        )
+
+    # Only employees of this analysis can be queried (case-insensitive)
+    employee_name = state["_lower_index"].get(request.employee_name.lower())
+    if employee_name is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Employee '{request.employee_name}' not found"
+        )
+
+    return employee_name
+
+async def _get_state(analysis_id: str) -> State:
+    """Look up a stored analysis or raise 404 if it is unknown or was evicted"""
+    async with _states_lock:
+        state = _states.get(analysis_id)
+
+    if state is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Analysis '{analysis_id}' not found. Please analyze invoices first using /analyze_invoices endpoint"
+        )
+
+    return state
+
 @app.post("/analyze_invoices")
 async def analyze_invoices(
     hr_policy: UploadFile = File(...),
     invoices_zip: UploadFile = File(...)
-):
+) -> Dict[str, Any]:
     """
     Endpoint to analyze invoices against HR policy
     
@@ -43,12 +213,14 @@ async def analyze_invoices(
         JSON response with analysis results
     """
     try:
-        # Reset global state
-        global global_state
-        global_state = State(
+        # Fresh state for this request so concurrent analyses don't interfere
+        analysis_id = str(uuid.uuid4())
+        state = State(
             md_text="",
+            policy_cache=None,
             employee_invoice_data={},
-            extract_invoice_data={}
+            extract_invoice_data={},
+            _lower_index={}
         )
         
         # Validate file types
@@ -58,39 +230,38 @@ async def analyze_invoices(
         if not invoices_zip.filename.lower().endswith('.zip'):
             raise HTTPException(status_code=400, detail="Invoices must be in ZIP format")
         
-        # Save uploaded files temporarily
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as hr_temp:
-            hr_temp.write(await hr_policy.read())
-            hr_temp_path = hr_temp.name
-        
-        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as zip_temp:
-            zip_temp.write(await invoices_zip.read())
-            zip_temp_path = zip_temp.name
+        # Save uploaded files temporarily, streaming in chunks to bound memory
+        hr_temp_path = await _spool(hr_policy, '.pdf')
+        zip_temp_path = await _spool(invoices_zip, '.zip')
         
         try:
-            # Step 1: Extract HR policy
-            global_state = extract_hr_policy_from_pdf(global_state, hr_temp_path)
+            # Step 1: Extract HR policy (blocking calls run off the event loop)
+            state = await asyncio.to_thread(extract_hr_policy_from_pdf, state, hr_temp_path)
             
-            # Step 2: Process invoices
-            global_state = process_invoices(global_state, zip_temp_path)
+            # Step 2: Process invoices; the cached HR policy is only needed here
+            try:
+                state = await process_invoices(state, zip_temp_path)
+            finally:
+                await asyncio.to_thread(delete_policy_cache, state)
             
             # Step 3: Generate summary
-            summary = get_summary(global_state)
-            global_state["extract_invoice_data"] = summary
+            summary = await get_summary(state)
+            state["extract_invoice_data"] = summary
+            state["_lower_index"] = build_lower_index(summary)
             
             # Step 4: Store in Pinecone
             if summary:
-                process_employees_to_pinecone(summary, PINECONE_API_KEY)
+                await asyncio.to_thread(process_employees_to_pinecone, summary, analysis_id)
             
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": "Invoice analysis completed successfully",
-                    "total_employees": len(summary),
-                    "employees_processed": list(summary.keys()),
-                    "analysis_summary": summary
-                }
-            )
+            await _save_state(analysis_id, state)
+            
+            return {
+                "message": "Invoice analysis completed successfully",
+                "analysis_id": analysis_id,
+                "total_employees": len(summary),
+                "employees_processed": list(summary.keys()),
+                "analysis_summary": summary
+            }
             
         finally:
             # Clean up temporary files
@@ -101,62 +272,93 @@ async def analyze_invoices(
         raise HTTPException(status_code=500, detail=f"Error processing invoices: {str(e)}")
 
 @app.post("/query_employee")
-async def query_employee(request: QueryRequest):
+async def query_employee(request: QueryRequest) -> Dict[str, Any]:
     """
     Endpoint to query specific employee data
     
     Args:
-        request: QueryRequest containing employee_name and query
+        request: QueryRequest containing analysis_id, employee_name and query
     
     Returns:
         JSON response with query answer
     """
     try:
-        # Check if data has been processed
-        if not global_state.get("extract_invoice_data"):
-            raise HTTPException(
-                status_code=400, 
-                detail="No data available. Please analyze invoices first using /analyze_invoices endpoint"
-            )
+        employee_name = await _resolve_query_employee(request)
         
-        # Query the employee data
-        answer = answer_query_for_employee(
-            employee_name=request.employee_name,
-            query=request.query
-        )
+        # Query the employee data (served from the semantic cache for repeated questions)
+        answer = await _answer_with_semantic_cache(request, employee_name)
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "employee_name": request.employee_name,
-                "query": request.query,
-                "answer": answer
-            }
-        )
+        return {
+            "employee_name": employee_name,
+            "query": request.query,
+            "answer": answer
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+@app.post("/query_employee/stream")
+async def query_employee_stream(request: QueryRequest):
+    """
+    Endpoint to query specific employee data, streaming the answer as plain text
+    
+    Args:
+        request: QueryRequest containing analysis_id, employee_name and query
+    
+    Returns:
+        Streamed text response with the answer as Gemini produces it
+    """
+    try:
+        employee_name = await _resolve_query_employee(request)
+        cache, vector, answer = await _semantic_cache_lookup(request, employee_name)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    
+    if answer is not None:
+        return StreamingResponse(iter([answer]), media_type="text/plain; charset=utf-8")
+    
+    async def stream_answer():
+        # The blocking Pinecone lookup and Gemini stream are iterated in a worker thread
+        chunks = []
+        try:
+            async for chunk in iterate_in_threadpool(
+                stream_query_for_employee(employee_name, request.query, request.analysis_id)
+            ):
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            logger.exception("Streaming the answer for employee '%s' failed", employee_name)
+            yield STREAM_ERROR_MARKER
+            return
+        
+        # Only a fully streamed answer is cached
+        _remember_answer(cache, vector, employee_name, "".join(chunks))
+    
+    return StreamingResponse(stream_answer(), media_type="text/plain; charset=utf-8")
 
 @app.get("/health")
-async def health_check():
+async def health_check() -> Dict[str, Any]:
     """Health check endpoint"""
     return {"status": "healthy", "message": "Invoice Analysis API is running"}
 
 @app.get("/employees")
-async def get_employees():
-    """Get list of all processed employees"""
+async def get_employees(analysis_id: str) -> Dict[str, Any]:
+    """Get list of all processed employees for an analysis"""
     try:
-        if not global_state.get("extract_invoice_data"):
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": "No employees processed yet",
-                    "employees": []
-                }
-            )
+        state = await _get_state(analysis_id)
+        if not state.get("extract_invoice_data"):
+            return {
+                "message": "No employees processed yet",
+                "employees": []
+            }
         
         employees_list = []
-        for employee_name, data in global_state["extract_invoice_data"].items():
+        for employee_name, data in state["extract_invoice_data"].items():
             employees_list.append({
                 "employee_name": employee_name,
                 "invoice_count": data.get("invoice_count", 0),
@@ -165,36 +367,30 @@ async def get_employees():
                 "description": data.get("description", "N/A")
             })
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "total_employees": len(employees_list),
-                "employees": employees_list
-            }
-        )
+        return {
+            "total_employees": len(employees_list),
+            "employees": employees_list
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving employees: {str(e)}")
 
 @app.get("/employee/{employee_name}")
-async def get_employee_details(employee_name: str):
-    """Get detailed information for a specific employee"""
+async def get_employee_details(employee_name: str, analysis_id: str) -> Dict[str, Any]:
+    """Get detailed information for a specific employee in an analysis"""
     try:
-        if not global_state.get("extract_invoice_data"):
+        state = await _get_state(analysis_id)
+        if not state.get("extract_invoice_data"):
             raise HTTPException(
                 status_code=400,
                 detail="No data available. Please analyze invoices first using /analyze_invoices endpoint"
             )
         
-        # Find employee (case-insensitive search)
-        employee_data = None
-        actual_name = None
-        
-        for name, data in global_state["extract_invoice_data"].items():
-            if name.lower() == employee_name.lower():
-                employee_data = data
-                actual_name = name
-                break
+        # Find employee (case-insensitive lookup through the lowercased name index)
+        actual_name = state["_lower_index"].get(employee_name.lower())
+        employee_data = state["extract_invoice_data"].get(actual_name)
         
         if not employee_data:
             raise HTTPException(
@@ -202,13 +398,10 @@ async def get_employee_details(employee_name: str):
                 detail=f"Employee '{employee_name}' not found"
             )
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "employee_name": actual_name,
-                "details": employee_data
-            }
-        )
+        return {
+            "employee_name": actual_name,
+            "details": employee_data
+        }
         
     except HTTPException:
         raise
@@ -217,4 +410,12 @@ async def get_employee_details(employee_name: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # A single worker process: analyses and their answer caches live in this
+    # process' memory, so extra workers would not see each other's analysis_ids
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools"
+    )
\ No newline at end of file
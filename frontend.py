@@ -30,6 +30,8 @@ if 'processed' not in st.session_state:
     st.session_state.processed = False
 if 'employees' not in st.session_state:
     st.session_state.employees = []
+if 'analysis_id' not in st.session_state:
+    st.session_state.analysis_id = None
 
 # Step 1: Upload Files
 st.header("Step 1: Upload Files")
@@ -55,6 +57,7 @@ if st.button(" Process Files"):
                 if response.status_code == 200:
                     result = response.json()
                     st.session_state.processed = True
+                    st.session_state.analysis_id = result.get('analysis_id')
                     st.session_state.employees = list(result.get('analysis_summary', {}).keys())
                     st.success(" Files processed successfully!")
                     
@@ -87,13 +90,18 @@ if st.session_state.processed:
     if st.button(" Ask Question"):
         if employee_name and query:
             try:
-                payload = {"employee_name": employee_name, "query": query}
-                response = requests.post(f"{API_URL}/query_employee", json=payload)
+                payload = {
+                    "analysis_id": st.session_state.analysis_id,
+                    "employee_name": employee_name,
+                    "query": query
+                }
+                # Stream the answer so the first words show up while Gemini is still generating
+                response = requests.post(f"{API_URL}/query_employee/stream", json=payload, stream=True)
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    response.encoding = 'utf-8'
                     st.subheader("Answer:")
-                    st.write(result.get('answer', 'No answer'))
+                    st.write_stream(response.iter_content(chunk_size=None, decode_unicode=True))
                 else:
                     st.error(f" Error: {response.text}")
                     
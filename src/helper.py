@@ -1,27 +1,175 @@
 import os
 import re
-import zipfile
+import asyncio
+import multiprocessing
+import shutil
 import tempfile
+import zipfile
 import pymupdf4llm
 import fitz
 import base64
-from typing import Dict, TypedDict
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional, TypedDict, Union
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
+from google.genai import types as genai_types
 from src.prompt import get_extraction_prompt
 
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = "gemini-2.5-flash"
+# Upper bound on in-flight Gemini requests when fanning out over invoices
+LLM_MAX_CONCURRENCY = 16
+# Description prompts are short, so the per-employee fan-out can go wider
+DESCRIPTION_MAX_CONCURRENCY = 32
+
+@lru_cache(maxsize=1)
+def _get_llm() -> ChatGoogleGenerativeAI:
+    """Shared Gemini client so the transport and connection pool are reused across calls"""
+    return ChatGoogleGenerativeAI(model=LLM_MODEL)
+
+# Regex patterns compiled once at import instead of per invoice
+_NAME_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'Customer Name[:\s]+([A-Za-z\s]+)',
+    r'Passenger[:\s]+([A-Za-z\s]+)',
+    r'Name[:\s]+([A-Za-z\s]+)',
+)]
+_STATUS_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'Status[:\s]+([A-Za-z\s*]+)',
+    r'Reimbursement[:\s]+([A-Za-z\s*]+)',
+)]
+_CATEGORY_RE = re.compile(r'Invoice Type[:\s]+([A-Za-z/]+)', re.IGNORECASE)
+# Invoice type keywords per category, checked in order (first match wins)
+_CATEGORY_MAP = {
+    'meal': ('meal', 'food'),
+    'travel': ('travel', 'ticket', 'flight', 'train'),
+    'cab': ('cab', 'taxi', 'uber', 'ola'),
+    'accomodation': ('hotel', 'house', 'pg', 'hostel'),
+}
+_DATE_RE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b')
+
+# Page rendering for the vision fallback: 1.5x zoom and JPEG keep OCR quality at a fraction of the payload
+VISION_RENDER_SCALE = 1.5
+VISION_JPEG_QUALITY = 80
+
+# A page is treated as tabular once this many rows have 3+ side-by-side text blocks
+TABLE_ROW_THRESHOLD = 3
+
+def _looks_tabular(blocks: list) -> bool:
+    """Detect table-like layout: several rows holding multiple text blocks on the same line"""
+    rows = Counter(round(block[1]) for block in blocks)
+    return sum(1 for cells in rows.values() if cells >= 3) >= TABLE_ROW_THRESHOLD
+
+def _open_pdf(source: Union[str, bytes]) -> fitz.Document:
+    """Open a PDF from a file path or from in-memory bytes"""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def _fast_text(source: Union[str, bytes]) -> str:
+    """
+    Extract plain text from a PDF in a single PyMuPDF pass.
+
+    Falls back to pymupdf4llm markdown conversion only when a page looks
+    tabular, which is where its layout analysis is worth the cost.
+    """
+    doc = _open_pdf(source)
+    try:
+        pages = []
+        for page in doc:
+            # Keep text blocks only (block type 0), images are handled by the vision path
+            blocks = [block for block in page.get_text("blocks") if block[6] == 0]
+            if _looks_tabular(blocks):
+                return pymupdf4llm.to_markdown(doc)
+            pages.append("\n".join(block[4] for block in blocks))
+
+        return "\n".join(pages)
+
+    finally:
+        doc.close()
+
+def _render_pages(source: Union[str, bytes]) -> list:
+    """Render every PDF page to a base64 JPEG for the vision model"""
+    doc = _open_pdf(source)
+    try:
+        matrix = fitz.Matrix(VISION_RENDER_SCALE, VISION_RENDER_SCALE)
+        return [
+            base64.b64encode(page.get_pixmap(matrix=matrix).tobytes("jpeg", jpg_quality=VISION_JPEG_QUALITY)).decode()
+            for page in doc
+        ]
+
+    finally:
+        doc.close()
+
 class State(TypedDict):
     """
     Represents the state of our graph.
 
     Attributes:
         md_text: contains HR Reimbursement Policy
-        employee_invoice_data: contains employee invoice data
+        policy_cache: Gemini cached-content name holding md_text, or None
+        employee_invoice_data: contains employee invoice data as
+            {"text": combined invoices, "count": invoice count}
         extract_invoice_data: contains processed invoice summary
+        _lower_index: maps lowercased employee names to their extract_invoice_data keys
     """
     md_text: str
-    employee_invoice_data: Dict[str, Dict[str, str]]
+    policy_cache: Optional[str]
+    employee_invoice_data: Dict[str, Dict[str, Any]]
     extract_invoice_data: Dict[str, Dict[str, str]]
+    _lower_index: Dict[str, str]
+
+# Lifetime of the Gemini context cache holding the HR policy; it is deleted once the
+# invoices are processed, so the TTL only bounds caches left behind by a crash
+POLICY_CACHE_TTL_SECONDS = 600
+
+def create_policy_cache(md_text: str) -> Optional[str]:
+    """
+    Upload the HR policy once as Gemini cached content so invoice prompts can omit it.
+
+    Uses the google-genai client behind the shared LangChain model. Returns the
+    cache name, or None when caching is unavailable (for example a policy below
+    Gemini's minimum cacheable size); prompts then embed the policy.
+    """
+    if not md_text or not md_text.strip():
+        return None
+
+    try:
+        cache = _get_llm().client.caches.create(
+            model=LLM_MODEL,
+            config=genai_types.CreateCachedContentConfig(
+                system_instruction=f"You analyze employee invoices against this HR reimbursement policy:\n\n{md_text}",
+                ttl=f"{POLICY_CACHE_TTL_SECONDS}s"
+            )
+        )
+        return cache.name
+
+    except Exception:
+        logger.warning("HR policy context caching unavailable, embedding the policy in prompts", exc_info=True)
+        return None
+
+def delete_policy_cache(state: State) -> None:
+    """Delete this state's cached HR policy, if any, so it stops being billed"""
+    cache_name = state.get("policy_cache")
+    if not cache_name:
+        return
+
+    try:
+        _get_llm().client.caches.delete(name=cache_name)
+    except Exception:
+        logger.warning("Could not delete HR policy cache %s", cache_name, exc_info=True)
+
+    state["policy_cache"] = None
+
+def _get_policy_llm(state: State):
+    """Gemini client bound to the cached HR policy when one exists for this state"""
+    cache_name = state.get("policy_cache")
+    if cache_name:
+        return _get_llm().bind(cached_content=cache_name)
+    return _get_llm()
 
 def extract_hr_policy_from_pdf(state: State, pdf_path: str) -> State:
     """
@@ -34,26 +182,16 @@ def extract_hr_policy_from_pdf(state: State, pdf_path: str) -> State:
     Returns:
         Updated state with md_text containing extracted policy
     """
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+    llm = _get_llm()
     
     try:
         # First try to extract directly from PDF
-        md_text = pymupdf4llm.to_markdown(pdf_path)
+        md_text = _fast_text(pdf_path)
 
         # If no text extracted, convert PDF to images and feed to gemini
         if not md_text or md_text.strip() == "":
-            pdf_document = fitz.open(pdf_path)
-            all_extracted_text = []
-
-            for page_num in range(len(pdf_document)):
-                # Convert page to PNG image
-                page = pdf_document[page_num]
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                img_data = pix.tobytes("png")
-                img_base64 = base64.b64encode(img_data).decode()
-
-                # Create message with image and prompt
-                message = HumanMessage(
+            messages = [
+                HumanMessage(
                     content=[
                         {
                             "type": "text",
@@ -62,246 +200,295 @@ def extract_hr_policy_from_pdf(state: State, pdf_path: str) -> State:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{img_base64}"
+                                "url": f"data:image/jpeg;base64,{img_base64}"
                             }
                         }
                     ]
                 )
+                for img_base64 in _render_pages(pdf_path)
+            ]
 
-                # Get extracted text from vision model
-                response = llm.invoke([message])
-                all_extracted_text.append(response.content)
+            # Get extracted text of all pages from vision model concurrently
+            responses = llm.batch(messages, config={"max_concurrency": LLM_MAX_CONCURRENCY})
+            md_text = "\n\n".join(response.content for response in responses)
 
-            pdf_document.close()
-            md_text = "\n\n".join(all_extracted_text)
-
-        # Update state with extracted text
+        # Update state with extracted text and cache it for the per-invoice prompts
         state["md_text"] = md_text
+        state["policy_cache"] = create_policy_cache(md_text)
         
     except Exception as e:
         state["md_text"] = ""
+        state["policy_cache"] = None
 
     return state
 
-def process_invoices(state: State, zip_path: str) -> State:
-    """Main function: Extract ZIP → Process PDFs → Store in state"""
+async def process_invoices(state: State, zip_path: str) -> State:
+    """Main function: Stream ZIP → Extract text from PDFs → Batch LLM calls → Store in state"""
     
     # Initialize state
     if "employee_invoice_data" not in state:
         state["employee_invoice_data"] = {}
 
     try:
+        # Steps 1-2: List the PDFs (spooling nested ZIPs once), then extract raw text from
+        # every PDF in parallel worker processes
         with tempfile.TemporaryDirectory() as temp_dir:
-            # Step 1: Extract ZIP and find all PDFs
-            pdf_files = extract_zip_and_find_pdfs(zip_path, temp_dir)
-
-            # Step 2: Process each PDF
-            for pdf_path in pdf_files:
-                invoice_data = extract_invoice_data(pdf_path, state)
-
-                if invoice_data:
-                    employee_name = get_employee_name(invoice_data)
-
-                    # Step 3: Store in state
-                    if employee_name in state["employee_invoice_data"]:
-                        state["employee_invoice_data"][employee_name] += "\n\n---\n\n" + invoice_data
-                    else:
-                        state["employee_invoice_data"][employee_name] = invoice_data
+            pdf_members = extract_zip_and_find_pdfs(zip_path, temp_dir)
+            raw_texts = await extract_texts_in_parallel(pdf_members)
+
+        # Route each PDF: text-layer invoices go to the LLM as text, scanned ones to vision
+        text_idx = [i for i, (_, text, _) in enumerate(raw_texts) if text.strip()]
+        vision_idx = [i for i, (_, text, _) in enumerate(raw_texts) if not text.strip()]
+
+        # Step 3: Fan out LLM calls concurrently (text batch + vision per scanned PDF)
+        text_results, vision_results = await asyncio.gather(
+            process_with_llm([raw_texts[i][1] for i in text_idx], state),
+            asyncio.gather(
+                *(extract_with_vision(raw_texts[i][2], state) for i in vision_idx),
+                return_exceptions=True
+            )
+        )
+
+        # Restore original PDF order so per-employee concatenation is stable
+        results = [""] * len(raw_texts)
+        for indices, values in ((text_idx, text_results), (vision_idx, vision_results)):
+            for i, value in zip(indices, values):
+                results[i] = value
+
+        for invoice_data in results:
+            if isinstance(invoice_data, Exception):
+                continue
+
+            if invoice_data:
+                employee_name = get_employee_name(invoice_data)
+
+                # Step 4: Store in state
+                add_invoice_to_employee(state, employee_name, invoice_data)
 
     except Exception as e:
-        state["employee_invoice_data"]["Error"] = str(e)
+        state["employee_invoice_data"]["Error"] = {"text": str(e), "count": 0}
 
     return state
 
-def extract_zip_and_find_pdfs(zip_path: str, extract_to: str) -> list:
-    """Extract ZIP file and return list of PDF file paths"""
-    pdf_files = []
+def add_invoice_to_employee(state: State, employee_name: str, invoice_data: str) -> None:
+    """Append an invoice to an employee's record, counting its invoices once"""
+    invoice_count = invoice_data.count("**INVOICE DETAILS:**")
+
+    record = state["employee_invoice_data"].get(employee_name)
+    if record is None:
+        state["employee_invoice_data"][employee_name] = {
+            "text": invoice_data,
+            "count": invoice_count
+        }
+    else:
+        record["text"] += "\n\n---\n\n" + invoice_data
+        record["count"] += invoice_count
+
+def extract_zip_and_find_pdfs(zip_path: str, temp_dir: str) -> list:
+    """
+    Return (archive path, member name) for every PDF in a ZIP, including those in nested ZIPs.
 
-    # Extract ZIP
+    Walks each central directory once with infolist(). Nested ZIPs are
+    decompressed once into temp_dir, so workers read their PDF from a plain
+    archive instead of re-inflating the enclosing one.
+    """
+    pdf_members = []
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
 
-    # Find all PDFs (including nested ZIPs)
-    for root, dirs, files in os.walk(extract_to):
-        for file in files:
-            file_path = os.path.join(root, file)
+            name = info.filename.lower()
+            if name.endswith('.pdf'):
+                pdf_members.append((zip_path, info.filename))
 
-            if file.lower().endswith('.pdf'):
-                pdf_files.append(file_path)
+            elif name.endswith('.zip'):
+                fd, nested_path = tempfile.mkstemp(suffix='.zip', dir=temp_dir)
+                with os.fdopen(fd, 'wb') as nested_file, zip_ref.open(info) as member:
+                    shutil.copyfileobj(member, nested_file)
+                pdf_members.extend(extract_zip_and_find_pdfs(nested_path, temp_dir))
 
-            elif file.lower().endswith('.zip'):
-                # Handle nested ZIP
-                nested_dir = os.path.join(root, f"nested_{file[:-4]}")
-                os.makedirs(nested_dir, exist_ok=True)
-                nested_pdfs = extract_zip_and_find_pdfs(file_path, nested_dir)
-                pdf_files.extend(nested_pdfs)
+    return pdf_members
 
-    return pdf_files
+@lru_cache(maxsize=1)
+def _get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for PDF extraction, created on first use and shared by all requests.
 
-def extract_invoice_data(pdf_path: str, state: State) -> str:
-    """Extract invoice data from PDF using text extraction or vision model"""
-    try:
-        # Try text extraction first
-        text = pymupdf4llm.to_markdown(pdf_path)
+    Workers are spawned rather than forked: the server process already runs
+    gRPC, torch and event-loop threads, which are unsafe to fork.
+    """
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def shutdown_extraction_pool() -> None:
+    """Stop the extraction workers, if they were started; called on app shutdown"""
+    if _get_extraction_pool.cache_info().currsize:
+        _get_extraction_pool().shutdown()
+        _get_extraction_pool.cache_clear()
+
+async def extract_texts_in_parallel(pdf_members: list) -> list:
+    """
+    Run the CPU-bound extraction across processes, returning (name, text, page_images) in input order.
 
-        if not text or text.strip() == "":
-            # Use vision model if text extraction fails
-            text = extract_with_vision(pdf_path, state)
-        else:
-            # Process extracted text with LLM
-            text = process_with_llm(text, state)
+    Workers get (archive path, member name) pairs rather than PDF bytes and read
+    their own PDF, so only the PDFs currently being processed are held in memory.
+    """
+    if not pdf_members:
+        return []
 
-        return text
+    loop = asyncio.get_running_loop()
+    executor = _get_extraction_pool()
+    return await asyncio.gather(
+        *(loop.run_in_executor(executor, extract_invoice_data, archive_path, member) for archive_path, member in pdf_members)
+    )
 
-    except Exception as e:
-        return ""
+def extract_invoice_data(archive_path: str, name: str) -> tuple:
+    """
+    Extract raw invoice text from one PDF in a ZIP without calling the LLM.
 
-def extract_with_vision(pdf_path: str, state: State) -> str:
-    """Use vision model to extract data from PDF images"""
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
-    doc = fitz.open(pdf_path)
-    all_text = []
+    PDFs without a text layer are rendered to page images here, so the
+    vision path's rendering also runs in the worker processes.
+    """
+    try:
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            pdf_bytes = zip_ref.read(name)
+        text = _fast_text(pdf_bytes) or ""
+        page_images = [] if text.strip() else _render_pages(pdf_bytes)
+        return name, text, page_images
+
+    except Exception as e:
+        return name, "", []
 
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        img_data = pix.tobytes("png")
-        img_base64 = base64.b64encode(img_data).decode()
+async def extract_with_vision(page_images: list, state: State) -> str:
+    """Use vision model to extract data from pre-rendered PDF page images"""
+    if not page_images:
+        return ""
 
-        # Get the image content first, then process with full prompt
-        message = HumanMessage(content=[
+    llm = _get_llm()
+    image_messages = [
+        HumanMessage(content=[
             {"type": "text", "text": "Extract all text and details from this invoice image:"},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_base64}"}}
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"}}
         ])
+        for img_base64 in page_images
+    ]
 
-        response = llm.invoke([message])
-        extracted_text = response.content
-
-        # Now process with full prompt including status prediction
-        full_prompt = get_extraction_prompt(state)
-        final_message = HumanMessage(content=f"{full_prompt}\n\nExtracted text:\n\n{extracted_text}")
-        final_response = llm.invoke([final_message])
+    # Get the image content of all pages first, then process with full prompt
+    responses = await llm.abatch(image_messages, config={"max_concurrency": LLM_MAX_CONCURRENCY})
+    extracted_texts = [response.content for response in responses]
 
-        all_text.append(final_response.content)
-
-    doc.close()
+    # Now process with full prompt including status prediction
+    all_text = await process_with_llm(extracted_texts, state)
     return "\n\n".join(all_text)
 
-def process_with_llm(text: str, state: State) -> str:
-    """Process text-extracted content with LLM for better structure"""
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+async def process_with_llm(texts: list, state: State) -> list:
+    """Process text-extracted contents with LLM for better structure, as one concurrent batch"""
+    if not texts:
+        return []
+
+    llm = _get_policy_llm(state)
     
     prompt = get_extraction_prompt(state)
-    message = HumanMessage(content=f"{prompt}\n\nExtracted text:\n\n{text}")
-    response = llm.invoke([message])
-
-    return response.content
+    messages = [HumanMessage(content=f"{prompt}\n\nExtracted text:\n\n{text}") for text in texts]
+    responses = await llm.abatch(
+        messages,
+        config={"max_concurrency": LLM_MAX_CONCURRENCY},
+        return_exceptions=True
+    )
+
+    # A failed call drops only that invoice, as the sequential version did
+    return ["" if isinstance(response, Exception) else response.content for response in responses]
+
+def _clean_marker_value(line: str) -> str:
+    """Return the value after the first ':' of a marker line with markdown emphasis removed"""
+    value = line.split(':', 1)[1].strip()
+    return value.replace('**', '').replace('*', '').strip()
+
+def _marker_values(text: str, marker: str) -> Iterator[str]:
+    """Yield the cleaned value after each occurrence of marker, locating lines with str.find"""
+    idx = text.find(marker)
+    while idx >= 0:
+        eol = text.find('\n', idx)
+        yield _clean_marker_value(text[idx:eol if eol >= 0 else None])
+        idx = text.find(marker, eol) if eol >= 0 else -1
+
+def _first_pattern_match(patterns: list, text: str) -> str:
+    """Return the first usable capture from a list of compiled fallback patterns, or None"""
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            value = match.group(1).strip()
+            if value and len(value) > 1:
+                return value
+
+    return None
 
 def get_employee_name(invoice_text: str) -> str:
     """Extract employee name from processed invoice text"""
     try:
-        lines = invoice_text.split('\n')
-
-        for line in lines:
-            if '**EMPLOYEE NAME:**' in line:
-                name = line.split(':', 1)[1].strip()
-                name = name.replace('**', '').replace('*', '').strip()
-
-                if name and name != "No information about employee":
-                    return name
+        for name in _marker_values(invoice_text, '**EMPLOYEE NAME:**'):
+            if name and name != "No information about employee":
+                return name
 
         # Fallback: search for customer patterns
-        patterns = [
-            r'Customer Name[:\s]+([A-Za-z\s]+)',
-            r'Passenger[:\s]+([A-Za-z\s]+)',
-            r'Name[:\s]+([A-Za-z\s]+)',
-        ]
-
-        for pattern in patterns:
-            matches = re.findall(pattern, invoice_text, re.IGNORECASE)
-            if matches:
-                name = matches[0].strip()
-                if name and len(name) > 1:
-                    return name
-
-        return "No information about employee"
+        return _first_pattern_match(_NAME_PATTERNS, invoice_text) or "No information about employee"
 
     except Exception as e:
         return "No information about employee"
 
-def get_reimbursement_status(invoice_text: str) -> str:
-    """Extract reimbursement status from processed invoice text"""
-    try:
-        lines = invoice_text.split('\n')
-
-        for line in lines:
-            if '**REIMBURSEMENT STATUS:**' in line:
-                status = line.split(':', 1)[1].strip()
-                status = status.replace('**', '').replace('*', '').strip()
-
-                if status:
-                    return status
-
-        # Fallback: search for status patterns
-        patterns = [
-            r'Status[:\s]+([A-Za-z\s*]+)',
-            r'Reimbursement[:\s]+([A-Za-z\s*]+)',
-        ]
-
-        for pattern in patterns:
-            matches = re.findall(pattern, invoice_text, re.IGNORECASE)
-            if matches:
-                status = matches[0].strip()
-                if status and len(status) > 1:
-                    return status
+def _normalize_category(category: str) -> str:
+    """Map a raw invoice type onto one of the supported categories"""
+    return next(
+        (name for name, keywords in _CATEGORY_MAP.items() if any(keyword in category for keyword in keywords)),
+        'other'
+    )
 
-        return "**Pending Review**"
-
-    except Exception as e:
-        return "**Pending Review**"
-
-def get_invoice_category_and_description(invoice_data: str) -> tuple:
-    """Extract invoice category and generate detailed description"""
-    try:
-        # Get category from invoice type
-        category_match = re.search(r'Invoice Type[:\s]+([A-Za-z/]+)', invoice_data, re.IGNORECASE)
-        category = category_match.group(1).lower() if category_match else "other"
-
-        # Normalize category
-        if 'meal' in category or 'food' in category:
-            category = 'meal'
-        elif 'travel' in category or 'ticket' in category or 'flight' in category or 'train' in category:
-            category = 'travel'
-        elif 'cab' in category or 'taxi' in category or 'uber' in category or 'ola' in category:
-            category = 'cab'
-        elif 'hotel' in category or 'house' in category or 'pg' in category or 'hostel' in category:
-            category = 'accomodation'
-        else:
-            category = 'other'
-
-        # Generate description using LLM
-        description = generate_description_with_llm(invoice_data, category)
-
-        return category, description
-
-    except Exception as e:
-        return "other", "Unable to generate description"
-
-def generate_description_with_llm(invoice_data: str, category: str) -> str:
-    """Use LLM to generate category-specific description"""
-    try:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+def _parse_invoice_fields(invoice_text: str) -> dict:
+    """
+    Extract reimbursement status and category in a single pass.
 
-        if category == 'travel':
-            prompt = """Based on the following invoice data, provide a SHORT travel description (max 2 lines):
+    Scans the lines once for the markers written by the extraction prompt and
+    only runs the regex fallbacks for fields whose marker was not found.
+    """
+    status = raw_category = None
+
+    for line in invoice_text.splitlines():
+        if status is None and '**REIMBURSEMENT STATUS:**' in line:
+            status = _clean_marker_value(line) or None
+        elif raw_category is None and 'Invoice Type' in line:
+            match = _CATEGORY_RE.search(line)
+            if match:
+                raw_category = match.group(1)
+
+        if status is not None and raw_category is not None:
+            break
+
+    if status is None:
+        status = _first_pattern_match(_STATUS_PATTERNS, invoice_text) or "**Pending Review**"
+    if raw_category is None:
+        match = _CATEGORY_RE.search(invoice_text)
+        raw_category = match.group(1) if match else "other"
+
+    return {
+        'status': status,
+        'category': _normalize_category(raw_category.lower())
+    }
+
+def _build_description_prompt(invoice_data: str, category: str) -> str:
+    """Build the category-specific description prompt for an employee's invoices"""
+    if category == 'travel':
+        prompt = """Based on the following invoice data, provide a SHORT travel description (max 2 lines):
 
 Include: Mode of travel, total cost, from which location to where, Date (should strictly match DD/MM/YYYY format), reason of given reimbursement
 Format: "Flight from Delhi to Mumbai, total cost ₹5,000, Date is 12/02/22, reason of partially reimbursement is that for traveling cost as per HR Policy we can reimburse only ₹2000 as per 5.2 Travel Expenses" or "Train journey from Chennai to Bangalore, total cost ₹800, Date is 12/3/23, since it is within limit as mentioned in HR Reimbursement Policy hence it is fully reimburse as per 5.2 Travel Expenses."
 
 Invoice data:
 """
-        elif category == 'meal':
-            prompt = """Based on the following invoice data, provide a SHORT meal description (max 2 lines):
+    elif category == 'meal':
+        prompt = """Based on the following invoice data, provide a SHORT meal description (max 2 lines):
 
 Include: Cuisine/food name, total cost, restaurant name, Date (should strictly match DD/MM/YYYY format), reason of given reimbursement
 Format: "North Indian cuisine at Punjabi Dhaba, total cost ₹450, Date is 4/2/25, within HR Policy Budget as per 5.1 Food and Beverages." or "Pizza and beverages at Domino's, total cost ₹600, Date is 23/5/24, it's not with HR Reimbursement policy as given budget by HR is ₹500 but your total cost is ₹600 hence it is partially reimburse as per 5.1 Food and Beverages."
@@ -311,24 +498,24 @@ Format: "Decline!!! as wine doesn't comes under reimbursement Policy as per 5.1
 
 Invoice data:
 """
-        elif category == 'cab':
-            prompt = """Based on the following invoice data, provide a SHORT cab description (max 2 lines):
+    elif category == 'cab':
+        prompt = """Based on the following invoice data, provide a SHORT cab description (max 2 lines):
 
 Include: Total cost, pickup and drop location if available, Date (should strictly match DD/MM/YYYY format), reason of given reimbursement
 Format: "Cab ride from Airport to Hotel, total cost ₹350, Date of travel is 23/2/21, it's more than HR Reimbursement Policy as per 5.2 Travel Expenses hence partially reimburse" or "Uber ride within city, total cost ₹120, Date of travel is 3/01/2002, its within the limit as per 5.2 Travel Expenses hence fully reimburse."
 
 Invoice data:
 """
-        elif category == 'accomodation':
-            prompt = """Based on the following invoice data, provide a SHORT accommodation description (max 2 lines):
+    elif category == 'accomodation':
+        prompt = """Based on the following invoice data, provide a SHORT accommodation description (max 2 lines):
 
 Include: Total cost, hotel name if available, Date (should strictly match DD/MM/YYYY format), reason of given reimbursement
 Format: "You stayed in hotel for 2 days, total cost ₹350, Date of travel is 23/2/21, it's more than HR Reimbursement Policy as per 5.3 Accommodation hence partially reimburse" or "You stayed in PG, total cost ₹120, Date of travel is 3/01/2002, its within the limit as per 5.3 Accommodation hence fully reimburse."
 
 Invoice data:
 """
-        else:
-            prompt = """Based on the following invoice data, provide a SHORT description (max 2 lines):
+    else:
+        prompt = """Based on the following invoice data, provide a SHORT description (max 2 lines):
 
 Include: Service type, total cost, Date (should strictly match DD/MM/YYYY format), brief details
 Format: "Service description with cost"
@@ -336,51 +523,75 @@ Format: "Service description with cost"
 Invoice data:
 """
 
-        message = HumanMessage(content=prompt + invoice_data)
-        response = llm.invoke([message])
+    return prompt + invoice_data
 
-        # Clean up the response
-        description = response.content.strip()
-        # Remove quotes if present
-        if description.startswith('"') and description.endswith('"'):
-            description = description[1:-1]
+def _clean_description(content: str) -> str:
+    """Clean up an LLM description response"""
+    description = content.strip()
+    # Remove quotes if present
+    if description.startswith('"') and description.endswith('"'):
+        description = description[1:-1]
 
-        return description
-
-    except Exception as e:
-        return f"Invoice total with basic details (Error: {str(e)})"
+    return description
 
-def get_summary(state: State) -> dict:
+async def get_summary(state: State) -> dict:
     """Get summary of all employees and their invoices with category and description"""
     if "employee_invoice_data" not in state:
         return {}
 
+    records = []
+    for employee_name, record in state["employee_invoice_data"].items():
+        # Count was accumulated when the invoices were added
+        invoice_data = record["text"]
+        invoice_count = record["count"]
+
+        # Parse category and status in one pass
+        fields = _parse_invoice_fields(invoice_data)
+        records.append((employee_name, invoice_data, invoice_count, fields))
+
+    # Generate all employee descriptions in one concurrent batch
+    messages = [
+        HumanMessage(content=_build_description_prompt(invoice_data, fields['category']))
+        for _, invoice_data, _, fields in records
+    ]
+    responses = await _get_llm().abatch(
+        messages,
+        config={"max_concurrency": DESCRIPTION_MAX_CONCURRENCY},
+        return_exceptions=True
+    ) if messages else []
+
     summary = {}
-    for employee_name, invoice_data in state["employee_invoice_data"].items():
-        invoice_count = invoice_data.count("**INVOICE DETAILS:**")
-        amounts = re.findall(r'Total Amount[:\s]+[₹$]\s*([0-9,]+\.?\d*)', invoice_data)
-        total_amount = sum(float(amt.replace(',', '')) for amt in amounts if amt)
-
-        # Get invoice category and description
-        category, description = get_invoice_category_and_description(invoice_data)
-        status = get_reimbursement_status(invoice_data)
+    for (employee_name, _, invoice_count, fields), response in zip(records, responses):
+        if isinstance(response, Exception):
+            description = f"Invoice total with basic details (Error: {str(response)})"
+        else:
+            description = _clean_description(response.content)
+
         summary[employee_name] = {
             'invoice_count': invoice_count,
-            'invoice_mode': category,
-            'Reimbursement_Status': status,
+            'invoice_mode': fields['category'],
+            'Reimbursement_Status': fields['status'],
             'description': description
         }
 
     return summary
 
+def build_lower_index(summary: dict) -> Dict[str, str]:
+    """Map lowercased employee names to their summary keys for case-insensitive lookup"""
+    lower_index = {}
+    for employee_name in summary:
+        # Keep the first name on case-only collisions, as the old linear scan did
+        lower_index.setdefault(employee_name.lower(), employee_name)
+
+    return lower_index
+
 def extract_date_from_description(description: str) -> str:
     """Extract date from description using regex."""
     if not description:
         return None
 
     # Simple regex for DD/MM/YYYY format
-    date_pattern = r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b'
-    match = re.search(date_pattern, description)
+    match = _DATE_RE.search(description)
 
     if match:
         day, month, year = match.groups()
@@ -1,6 +1,12 @@
+def _policy_text(state):
+    """HR policy to inline in a prompt, or a pointer to it when it is held in Gemini's context cache"""
+    if state.get("policy_cache"):
+        return "(Provided in the system instructions.)"
+    return state.get("md_text", "")
+
 def get_extraction_prompt(state):
     """Standard prompt for invoice data extraction"""
-    md_text = state.get("md_text", "")
+    md_text = _policy_text(state)
     
     return f"""Extract invoice information and identify the EMPLOYEE NAME.
 
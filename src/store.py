@@ -1,157 +1,362 @@
 import time
 import re
-from typing import Dict, List, Optional
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.schema import Document
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+import torch
+from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import StaticEmbedding
+from langchain_core.documents import Document
 from pinecone.grpc import PineconeGRPC as Pinecone
 from pinecone import ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from pinecone.exceptions import PineconeApiException
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
 from src.prompt import get_query_response_prompt
+from src.helper import _get_llm
+from src.config import PINECONE_API_KEY
 
+logger = logging.getLogger(__name__)
+
+# Answer given when an employee has no stored record
+NO_DATA_ANSWER = "No data found for employee: {employee_name}"
+# Each analysis stores its employee records in its own namespace, named by analysis_id
 INDEX_NAME = "employee-database"
+# all-MiniLM-L6-v2 output size, used for user-query embeddings
+EMBEDDING_DIMENSION = 384
+# Static Model2Vec model for the employee records stored in Pinecone, and its output size
+INDEX_EMBEDDING_MODEL = "minishlab/M2V_base_output"
+INDEX_DIMENSION = 256
+# Constant query vector for metadata-only lookups (cosine indexes reject all-zero vectors)
+_METADATA_QUERY_VECTOR = [1.0] * INDEX_DIMENSION
+# DD/MM/YYYY dates in generated descriptions
+_DATE_RE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b')
+# Pinecone accepts up to 100 vectors per upsert request
+UPSERT_BATCH_SIZE = 100
+# Threads embedding and upserting batches concurrently during ingest
+INGEST_WORKERS = 8
+# How long to wait for upserted records to show up in the index stats, and how often to check
+INGEST_VISIBILITY_TIMEOUT = 10.0
+INGEST_VISIBILITY_POLL_INTERVAL = 0.05
+
+# Graph-optimized ONNX export shipped in the model repo, used for CPU inference
+ONNX_MODEL_FILE = "onnx/model_O3.onnx"
+
+class StaticEmbeddings(Embeddings):
+    """LangChain Embeddings adapter over a Model2Vec static-embedding SentenceTransformer"""
+
+    def __init__(self, model_name: str):
+        self.model = SentenceTransformer(modules=[StaticEmbedding.from_model2vec(model_name)])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).tolist()
 
-def process_employees_to_pinecone(employee_invoice_data: Dict[str, Dict[str, str]], pinecone_api_key: str):
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+@lru_cache(maxsize=1)
+def _get_index_embeddings() -> StaticEmbeddings:
     """
-    Process employee data and add to Pinecone.
+    Static embeddings for ingest: a token-embedding lookup with no transformer pass.
+
+    Employee records are retrieved by id or metadata filter, so their vectors do
+    not drive correctness and the cheaper model costs nothing in answer quality.
     """
-    # Initialize embeddings and Pinecone
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    pc = Pinecone(api_key=pinecone_api_key)
+    return StaticEmbeddings(INDEX_EMBEDDING_MODEL)
 
-    # Create index if it doesn't exist
-    existing_indexes = [index.name for index in pc.list_indexes()]
+@lru_cache(maxsize=1)
+def _get_embeddings() -> HuggingFaceEmbeddings:
+    """Transformer embedding model loaded once per process for user-query similarity"""
+    if torch.cuda.is_available():
+        # FP16 weights halve memory traffic, which bounds MiniLM throughput on GPU
+        model_kwargs = {
+            "device": "cuda",
+            "model_kwargs": {"torch_dtype": torch.float16}
+        }
+        batch_size = 128
+    else:
+        # ONNX Runtime is 2-3x faster than PyTorch for MiniLM on CPU with the same outputs
+        model_kwargs = {
+            "device": "cpu",
+            "backend": "onnx",
+            "model_kwargs": {"file_name": ONNX_MODEL_FILE}
+        }
+        batch_size = 64
+
+    return HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        model_kwargs=model_kwargs,
+        encode_kwargs={"normalize_embeddings": True, "batch_size": batch_size}
+    )
 
-    if INDEX_NAME in existing_indexes:
+@lru_cache(maxsize=1)
+def _get_pc() -> Pinecone:
+    """Pinecone gRPC client created once per process"""
+    return Pinecone(api_key=PINECONE_API_KEY)
+
+@lru_cache(maxsize=1)
+def _get_index():
+    """
+    Index handle shared by ingest and lookups, so the gRPC channel is opened once.
+
+    Call _get_index.cache_clear() after the index is deleted or recreated.
+    """
+    return _get_pc().Index(INDEX_NAME)
+
+@lru_cache(maxsize=1)
+def _get_chain() -> Runnable:
+    """Query-answering prompt | LLM | string-parser pipeline built once; it holds no per-request state"""
+    prompt_template = PromptTemplate(
+        template=get_query_response_prompt(),
+        input_variables=["context", "question"]
+    )
+
+    return prompt_template | _get_llm() | StrOutputParser()
+
+def get_query_embedding(query: str) -> List[float]:
+    """Embed a user query for comparing it with earlier queries"""
+    return _get_embeddings().embed_query(query)
+
+def _wait_with_backoff(condition, initial_delay: float = 0.25, max_delay: float = 8.0) -> None:
+    """Poll condition() until it is truthy, doubling the sleep between checks up to max_delay"""
+    delay = initial_delay
+    while not condition():
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def prepare_employee_index() -> None:
+    """
+    Make sure the employee index exists with INDEX_DIMENSION; called once at app startup.
+
+    Rebuilding an index built for a different embedding model happens only
+    here, before any analysis can be ingesting into or querying it.
+    """
+    pc = _get_pc()
+
+    if pc.has_index(INDEX_NAME) and pc.describe_index(INDEX_NAME).dimension != INDEX_DIMENSION:
         pc.delete_index(INDEX_NAME)
-        
+        _get_index.cache_clear()
+
         # Wait for deletion to complete
-        while INDEX_NAME in [index.name for index in pc.list_indexes()]:
-            time.sleep(1)
-
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=384,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
+        _wait_with_backoff(lambda: not pc.has_index(INDEX_NAME))
+
+    if not pc.has_index(INDEX_NAME):
+        try:
+            pc.create_index(
+                name=INDEX_NAME,
+                dimension=INDEX_DIMENSION,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+        except PineconeApiException as e:
+            # Another process created it between the check and the create call
+            if e.status != 409:
+                raise
+
+        _get_index.cache_clear()
 
     # Wait for index to be ready
-    while not pc.Index(INDEX_NAME).describe_index_stats():
-        time.sleep(1)
+    _wait_with_backoff(lambda: pc.describe_index(INDEX_NAME).status["ready"])
 
-    # Initialize vector store
-    vector_store = PineconeVectorStore(
-        index_name=INDEX_NAME,
-        embedding=embeddings
-    )
+def process_employees_to_pinecone(employee_invoice_data: Dict[str, Dict[str, str]], namespace: str):
+    """
+    Process employee data and add to Pinecone under the analysis' namespace.
+
+    The index must already exist (see prepare_employee_index). Returns the
+    number of employee records that were embedded and upserted.
+    """
+    embeddings = _get_index_embeddings()
+
+    # Embed and upsert batch by batch; at most INGEST_WORKERS * 2 batches are held
+    # in memory, and embedding batch k+1 overlaps the gRPC upsert of batch k
+    index = _get_index()
+    documents = _employee_documents(employee_invoice_data)
+    pending = deque()
+    upserted = 0
+
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        while batch := list(islice(documents, UPSERT_BATCH_SIZE)):
+            pending.append(executor.submit(_ingest_batch, index, embeddings, batch, namespace))
+            if len(pending) >= INGEST_WORKERS * 2:
+                upserted += pending.popleft().result()
+
+        while pending:
+            upserted += pending.popleft().result()
+
+    # Wait until the records are visible instead of sleeping a fixed second; the
+    # namespace is new for this analysis, so every upserted id adds to its count
+    deadline = time.monotonic() + INGEST_VISIBILITY_TIMEOUT
+    while _namespace_vector_count(index, namespace) < upserted and time.monotonic() < deadline:
+        time.sleep(INGEST_VISIBILITY_POLL_INTERVAL)
 
-    # Process each employee
-    all_chunks = []
+    return upserted
 
+def _namespace_vector_count(index, namespace: str) -> int:
+    """Number of vectors currently visible in a namespace (0 before its first write lands)"""
+    summary = index.describe_index_stats().namespaces.get(namespace)
+    return summary.vector_count if summary else 0
+
+def delete_orphaned_employee_records(live_namespaces: Iterable[str]) -> None:
+    """
+    Delete every namespace that does not belong to a live analysis.
+
+    Namespaces are normally deleted when their analysis is evicted; this sweep
+    reclaims the ones left behind by a restart or crash.
+    """
+    live_namespaces = set(live_namespaces)
+    for namespace in _get_index().describe_index_stats().namespaces:
+        if namespace not in live_namespaces:
+            delete_employee_records(namespace)
+
+def delete_employee_records(namespace: str) -> None:
+    """Delete every employee record stored for an analysis"""
+    try:
+        _get_index().delete(delete_all=True, namespace=namespace)
+    except Exception:
+        logger.warning("Could not delete Pinecone namespace %s", namespace, exc_info=True)
+
+def _employee_documents(employee_invoice_data: Dict[str, Dict[str, str]]) -> Iterator[Document]:
+    """Yield one Document per employee summary"""
     for employee_name, employee_data in employee_invoice_data.items():
-        # Create text content
-        text = f"""
-        Employee Name: {employee_name}
-        Invoice Count: {employee_data.get('invoice_count', 0)}
-        Invoice Mode: {employee_data.get('invoice_mode', 'N/A')}
-        Reimbursement Status: {employee_data.get('Reimbursement_Status', 'N/A')}
-        Description: {employee_data.get('description', 'N/A')}
-        """
+        invoice_count = employee_data.get('invoice_count', 0)
+        invoice_mode = employee_data.get('invoice_mode', 'N/A')
+        status = employee_data.get('Reimbursement_Status', 'N/A')
+        description = employee_data.get('description') or 'N/A'
+
+        # Create text content: short labels keep the embedded token count down while
+        # staying readable as LLM context for employee queries
+        text = (
+            f"Employee: {employee_name}\n"
+            f"Invoices: {invoice_count}\n"
+            f"Mode: {invoice_mode}\n"
+            f"Status: {status}\n"
+            f"Description: {description}"
+        )
 
         # Extract date from description
-        extracted_date = extract_date_from_description(employee_data.get('description', ''))
+        extracted_date = extract_date_from_description(description)
 
         # Create document
-        doc = Document(
-            page_content=text.strip(),
+        yield Document(
+            page_content=text,
             metadata={
                 "employee_name": employee_name,
                 "date": extracted_date,
-                "document_type": "employee_record",
-                "text": text.strip()
+                "document_type": "employee_record"
             }
         )
 
-        all_chunks.append(doc)
+def _record_id(employee_name: str) -> str:
+    """ASCII-safe vector id for an employee (Pinecone ids must be ASCII; names come from the LLM)"""
+    return hashlib.sha1(employee_name.encode()).hexdigest()
 
-    # Add all documents to Pinecone
-    vector_store.add_documents(all_chunks)
-    time.sleep(1)
-    
-    return all_chunks
+def _ingest_batch(index, embeddings: Embeddings, docs: List[Document], namespace: str) -> int:
+    """Embed and upsert one batch of employee Documents, returning how many were written"""
+    vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+    records = [
+        # The hashed employee name is the vector id within the analysis' namespace, and
+        # the name itself stays in metadata. The page content is stored once, under
+        # "text"; Pinecone rejects null metadata values (e.g. a missing date)
+        (
+            _record_id(doc.metadata["employee_name"]),
+            vector,
+            {**{key: value for key, value in doc.metadata.items() if value is not None}, "text": doc.page_content}
+        )
+        for doc, vector in zip(docs, vectors)
+    ]
+    index.upsert(vectors=records, namespace=namespace)
+
+    return len(records)
 
 def extract_date_from_description(description: str) -> Optional[str]:
     """Extract date from description using regex."""
-    if not description:
+    if not description or '/' not in description:
         return None
 
     # Simple regex for DD/MM/YYYY format
-    date_pattern = r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b'
-    match = re.search(date_pattern, description)
+    match = _DATE_RE.search(description)
 
     if match:
-        day, month, year = match.groups()
-        return f"{day.zfill(2)}/{month.zfill(2)}/{year}"
+        return f"{match[1]:0>2}/{match[2]:0>2}/{match[3]}"
 
     return None
 
-def search_by_employee_name(employee_name: str, top_k: int = 10):
+def _to_document(metadata: Optional[dict]) -> Document:
+    """Rebuild a Document from stored metadata, whose "text" field holds the page content"""
+    metadata = dict(metadata or {})
+    return Document(page_content=metadata.pop("text", ""), metadata=metadata)
+
+def search_by_employee_name(employee_name: str, namespace: str, top_k: int = 10):
     """
-    Search for documents by employee name using metadata filtering
+    Look up an employee's records in an analysis' namespace by id, falling back to metadata filtering.
+
+    Records are stored under an id derived from the employee name, so a point fetch needs no query
+    embedding or ANN search; the filtered query covers records stored under
+    other ids.
     """
-    # Initialize embeddings (same as used during indexing)
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    index = _get_index()
 
-    # Initialize vector store
-    vector_store = PineconeVectorStore(
-        index_name=INDEX_NAME,
-        embedding=embeddings
+    record_id = _record_id(employee_name)
+    fetched = index.fetch(ids=[record_id], namespace=namespace)
+    if record_id in fetched.vectors:
+        return [(_to_document(fetched.vectors[record_id].metadata), 1.0)]
+
+    # Create metadata filter for employee name; the query vector itself is irrelevant
+    results = index.query(
+        vector=_METADATA_QUERY_VECTOR,
+        top_k=top_k,
+        filter={"employee_name": employee_name},
+        namespace=namespace,
+        include_metadata=True
     )
 
-    # Create metadata filter for employee name
-    metadata_filter = {"employee_name": employee_name}
+    return [(_to_document(match.metadata), match.score) for match in results.matches]
 
-    # Perform search with metadata filter
-    results = vector_store.similarity_search_with_score(
-        query="employee record",
-        k=top_k,
-        filter=metadata_filter
-    )
+def _employee_context(employee_name: str, namespace: str, top_k: int) -> Optional[str]:
+    """Concatenate the employee's stored records into LLM context, or None if there are none"""
+    # There is one record per employee id, so this is normally a single fetch and
+    # top_k only bounds the metadata-filter fallback
+    results = search_by_employee_name(employee_name, namespace, top_k=top_k)
+
+    if not results:
+        return None
 
-    return results
+    return "\n\n".join([doc.page_content for doc, _ in results])
 
-def answer_query_for_employee(employee_name: str, query: str, top_k: int = 5):
+def answer_query_for_employee(employee_name: str, query: str, namespace: str, top_k: int = 1):
     """
     Answer a user query for a specific employee using Pinecone context and Gemini LLM.
     """
-    # Initialize Gemini LLM
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
-    
-    # Step 1: Get relevant documents for the employee
-    results = search_by_employee_name(employee_name, top_k=top_k)
+    # Step 1: Get the employee's context from Pinecone
+    context = _employee_context(employee_name, namespace, top_k)
 
-    if not results:
-        return f"No data found for employee: {employee_name}"
+    if context is None:
+        return NO_DATA_ANSWER.format(employee_name=employee_name)
 
-    # Step 2: Concatenate all context from Pinecone
-    context = "\n\n".join([doc.page_content for doc, _ in results])
+    # Step 2: Run the cached chain
+    return _get_chain().invoke({
+        "context": context,
+        "question": query
+    })
 
-    # Step 3: Define a prompt template
-    prompt_template = PromptTemplate(
-        template=get_query_response_prompt(),
-        input_variables=["context", "question"]
-    )
+def stream_query_for_employee(employee_name: str, query: str, namespace: str, top_k: int = 1) -> Iterator[str]:
+    """
+    Like answer_query_for_employee, but yield the answer in chunks as Gemini produces them.
+    """
+    context = _employee_context(employee_name, namespace, top_k)
 
-    # Step 4: Create LLM Chain
-    chain = LLMChain(llm=llm, prompt=prompt_template)
+    if context is None:
+        yield NO_DATA_ANSWER.format(employee_name=employee_name)
+        return
 
-    # Step 5: Run the chain
-    response = chain.run({
+    yield from _get_chain().stream({
         "context": context,
         "question": query
     })
-
-    return response
\ No newline at end of file